@@ -0,0 +1,6 @@
+import os
+import sys
+
+# llm_server.py imports its helpers as top-level modules (it runs as a script from textflow/),
+# so the tests import them the same way.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'textflow'))
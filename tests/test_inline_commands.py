@@ -0,0 +1,230 @@
+import configparser
+import logging
+
+from diagnostics import Tracer
+from inline_commands import InlineCommands, DEFAULT_PROMPT, RESULT_PREFIX, FAILED
+
+
+log = logging.getLogger('textflow.test')
+
+
+class FakeMark:
+    def __init__(self, line):
+        self.line = line
+        self.deleted = False
+
+    def get_deleted(self):
+        return self.deleted
+
+
+class FakeIter:
+    def __init__(self, buffer, line, at_end=False):
+        self.buffer = buffer
+        self.line = line
+        self.at_end = at_end
+
+    def get_line(self):
+        return self.line
+
+    def copy(self):
+        return FakeIter(self.buffer, self.line, self.at_end)
+
+    def ends_line(self):
+        return self.at_end or not self.buffer.lines[self.line]
+
+    def forward_to_line_end(self):
+        self.at_end = True
+
+
+class FakeBuffer:
+    """Just enough of Gtk.TextBuffer, one line at a time; marks have left gravity like the plugin's"""
+    def __init__(self, text, cursor_line):
+        self.lines = text.split('\n')
+        self.cursor = FakeMark(cursor_line)
+        self.marks = []
+
+    def text(self):
+        return '\n'.join(self.lines)
+
+    def get_insert(self):
+        return self.cursor
+
+    def get_iter_at_mark(self, mark):
+        return FakeIter(self, mark.line)
+
+    def get_iter_at_line(self, line):
+        return FakeIter(self, line)
+
+    def create_mark(self, name, where, left_gravity):
+        mark = FakeMark(where.line)
+        self.marks.append(mark)
+        return mark
+
+    def delete_mark(self, mark):
+        mark.deleted = True
+        self.marks.remove(mark)
+
+    def get_text(self, start, end, include_hidden):
+        return self.lines[start.line] if end.at_end or not self.lines[start.line] else ''
+
+    def begin_user_action(self):
+        pass
+
+    def end_user_action(self):
+        pass
+
+    def insert(self, where, text):
+        # The plugin only ever appends new lines after the end of a line
+        assert where.at_end and text.startswith('\n')
+        self.insert_line(where.line + 1, text[1:])
+
+    def insert_line(self, line, text):
+        self.lines.insert(line, text)
+        for mark in self.marks:
+            if mark.line >= line:
+                mark.line += 1
+
+
+class SyncCommands(InlineCommands):
+    """Runs jobs when the test says so, and idle callbacks straight after"""
+    def __init__(self, answers, max_pending=4):
+        super().__init__(self.answer, log, Tracer('test', enabled=False), max_pending=max_pending,
+                         idle_add=self.schedule)
+        self.answers = answers
+        self.prompts = []
+        self.jobs = []
+        self.idle = []
+
+    def answer(self, prompt, trace_id):
+        self.prompts.append(prompt)
+        return self.answers(prompt) if callable(self.answers) else self.answers
+
+    def schedule(self, fn, *args):
+        self.idle.append((fn, args))
+
+    def submit(self, fn, *args):
+        if len(self.jobs) >= self.max_pending:
+            return False
+        self.jobs.append((fn, args))
+        return True
+
+    def finish(self):
+        """Run the oldest job, then the main-loop work it schedules, as _on_done would"""
+        fn, args = self.jobs.pop(0)
+        fn(*args)
+        self.schedule(self._submit_queued)
+        while self.idle:
+            fn, args = self.idle.pop(0)
+            fn(*args)
+
+
+def test_command_fires_once_after_cursor_leaves_line():
+    doc = FakeBuffer("-- I see you", cursor_line=0)
+    commands = SyncCommands('hello')
+
+    commands.scan(doc, doc.text())
+    assert commands.jobs == []
+
+    doc.insert_line(1, '')
+    doc.cursor.line = 1
+    for _ in range(3):
+        commands.scan(doc, doc.text())
+    assert len(commands.jobs) == 1
+
+    commands.finish()
+    assert doc.lines == ['-- I see you', RESULT_PREFIX + 'hello', '']
+    commands.scan(doc, doc.text())
+    assert commands.jobs == []
+    assert commands.prompts == ['I see you']
+
+
+def test_identical_lines_each_run_once():
+    doc = FakeBuffer("-- I see you\n-- I see you\n", cursor_line=2)
+    commands = SyncCommands('hello')
+
+    for _ in range(3):
+        commands.scan(doc, doc.text())
+    assert len(commands.jobs) == 2
+
+    commands.finish()
+    commands.finish()
+    assert doc.lines == ['-- I see you', RESULT_PREFIX + 'hello', '-- I see you', RESULT_PREFIX + 'hello', '']
+
+
+def test_failed_command_waits_for_an_edit():
+    doc = FakeBuffer("-- I see you\n", cursor_line=1)
+    commands = SyncCommands(None)
+
+    commands.scan(doc, doc.text())
+    commands.finish()
+    commands.scan(doc, doc.text())
+    assert commands.jobs == []
+    assert len(commands.prompts) == 1
+
+    doc.lines[0] = '-- I see you again'
+    commands.scan(doc, doc.text())
+    assert len(commands.jobs) == 1
+
+
+def test_exception_in_infer_marks_command_failed():
+    def boom(prompt):
+        raise RuntimeError('server went away')
+
+    doc = FakeBuffer("-- I see you\n", cursor_line=1)
+    commands = SyncCommands(boom)
+
+    commands.scan(doc, doc.text())
+    command = commands._commands[id(doc)][0]
+    commands.finish()
+    assert command['state'] == FAILED
+    commands.scan(doc, doc.text())
+    assert commands.jobs == []
+
+
+def test_queued_commands_start_as_slots_free():
+    doc = FakeBuffer("-- I see you 1\n-- I see you 2\n-- I see you 3\n", cursor_line=3)
+    commands = SyncCommands(lambda prompt: prompt.upper(), max_pending=1)
+
+    commands.scan(doc, doc.text())
+    assert len(commands.jobs) == 1
+    commands.finish()
+    assert len(commands.jobs) == 1
+    commands.finish()
+    commands.finish()
+    assert commands.jobs == []
+    assert commands.prompts == ['I see you 1', 'I see you 2', 'I see you 3']
+    assert doc.lines[1::2] == [RESULT_PREFIX + 'I SEE YOU 1', RESULT_PREFIX + 'I SEE YOU 2',
+                               RESULT_PREFIX + 'I SEE YOU 3']
+
+
+def test_result_for_edited_line_is_discarded():
+    doc = FakeBuffer("-- I see you\n", cursor_line=1)
+    commands = SyncCommands('hello')
+
+    commands.scan(doc, doc.text())
+    doc.lines[0] = '-- I see you later'
+    commands.finish()
+    assert doc.lines == ['-- I see you later', '']
+    assert doc.marks == []
+
+
+def test_result_lands_under_its_line_after_edits_above():
+    doc = FakeBuffer("-- I see you\n", cursor_line=1)
+    commands = SyncCommands('hello')
+
+    commands.scan(doc, doc.text())
+    doc.insert_line(0, 'Some new text')
+    commands.finish()
+    assert doc.lines == ['Some new text', '-- I see you', RESULT_PREFIX + 'hello', '']
+
+
+def test_invalid_prompt_keeps_default():
+    commands = SyncCommands('hello')
+    config = configparser.ConfigParser()
+    config.read_string("[inline_commands]\nprompt = Answer {line} as {style}\n")
+    commands.configure(config)
+    assert commands.prompt == DEFAULT_PROMPT
+
+    config.read_string("[inline_commands]\nprompt = Answer briefly: {line}\n")
+    commands.configure(config)
+    assert commands.prompt == 'Answer briefly: {line}'
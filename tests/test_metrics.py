@@ -0,0 +1,69 @@
+from metrics import ServerMetrics
+
+
+def test_request_latency_histogram_and_errors():
+    metrics = ServerMetrics()
+    metrics.observe_request('/inference', 0.3, 200)
+    metrics.observe_request('/inference', 100, 500)
+
+    stats = metrics.snapshot(model_loaded=True)['requests']['/inference']
+    assert stats['errors'] == 1
+    assert stats['latency_seconds']['count'] == 2
+    assert stats['latency_seconds']['buckets']['0.5'] == 1
+    assert stats['latency_seconds']['buckets']['+Inf'] == 1
+
+
+def test_generation_tokens_are_recorded_per_request():
+    metrics = ServerMetrics()
+    metrics.observe_generation({'usage': {'prompt_tokens': 10, 'completion_tokens': 20}}, 0.5)
+    metrics.observe_generation({'usage': {'prompt_tokens': 300, 'completion_tokens': 2}}, 1.0)
+
+    tokens = metrics.snapshot(model_loaded=True)['tokens']
+    assert tokens['prompt_per_request']['count'] == 2
+    assert tokens['prompt_per_request']['sum'] == 310
+    assert tokens['prompt_per_request']['buckets']['16'] == 1
+    assert tokens['prompt_per_request']['buckets']['512'] == 1
+    assert tokens['completion_per_request']['sum'] == 22
+    assert tokens['tokens_per_second']['buckets']['50'] == 1  # 40 tok/s
+    assert tokens['tokens_per_second_avg'] == 22 / 1.5
+
+
+def test_generation_without_usage_is_not_counted_as_tokens():
+    metrics = ServerMetrics()
+    metrics.observe_generation({'usage': {'prompt_tokens': 10, 'completion_tokens': 20}}, 0.5)
+    metrics.observe_generation({'choices': [{'text': 'hi'}]}, 0.5)
+    metrics.observe_generation('plain string', 0.5)
+
+    tokens = metrics.snapshot(model_loaded=True)['tokens']
+    assert tokens['prompt_per_request']['count'] == 1
+    assert tokens['generations_without_usage'] == 2
+    assert tokens['generation_seconds_total'] == 0.5
+
+
+def test_lock_and_parse_failures():
+    metrics = ServerMetrics()
+    metrics.observe_lock(0.1, 0.5)
+    metrics.observe_lock(0.2, 0.5)
+    metrics.observe_parse_failure()
+
+    snap = metrics.snapshot(model_loaded=False)
+    assert snap['model_lock'] == {'acquisitions': 2, 'wait_seconds_total': 0.1 + 0.2, 'hold_seconds_total': 1.0}
+    assert snap['extract_names_parse_failures'] == 1
+
+
+def test_prometheus_histograms_are_cumulative():
+    metrics = ServerMetrics()
+    metrics.observe_request('/health', 0.001, 200)
+    metrics.observe_request('/health', 0.2, 200)
+    metrics.observe_generation({'usage': {'prompt_tokens': 10, 'completion_tokens': 20}}, 0.5)
+
+    lines = metrics.to_prometheus(model_loaded=True).splitlines()
+    assert 'textflow_requests_total{endpoint="/health"} 2' in lines
+    assert 'textflow_request_latency_seconds_bucket{endpoint="/health",le="0.005"} 1' in lines
+    assert 'textflow_request_latency_seconds_bucket{endpoint="/health",le="0.25"} 2' in lines
+    assert 'textflow_request_latency_seconds_bucket{endpoint="/health",le="+Inf"} 2' in lines
+    assert 'textflow_request_latency_seconds_count{endpoint="/health"} 2' in lines
+    assert '# TYPE textflow_prompt_tokens histogram' in lines
+    assert 'textflow_prompt_tokens_bucket{le="16"} 1' in lines
+    assert 'textflow_prompt_tokens_sum 10.0' in lines
+    assert 'textflow_prompt_tokens_count 1' in lines
@@ -0,0 +1,98 @@
+from name_memory import NameColourMemory, NEW_CONFIDENCE
+
+
+TEXT = "Oli is sad.\nNay is regal."
+
+
+def test_new_names_are_not_known_until_classified():
+    memory = NameColourMemory()
+    assert memory.known_names(TEXT) == []
+
+    memory.update([('Oli', 'blue'), ('Nay', 'purple')], TEXT)
+    assert sorted(memory.known_names(TEXT)) == ['Nay', 'Oli']
+    assert sorted(memory.pairs(TEXT)) == [('Nay', 'purple'), ('Oli', 'blue')]
+
+
+def test_changed_context_is_reclassified():
+    memory = NameColourMemory()
+    memory.update([('Oli', 'blue'), ('Nay', 'purple')], TEXT)
+
+    edited = TEXT + "\nOli is happy now"
+    assert memory.known_names(edited) == ['Nay']
+
+
+def test_colour_only_switches_after_repeated_disagreement():
+    memory = NameColourMemory()
+    memory.update([('Oli', 'blue')], TEXT)
+
+    memory.update([('Oli', 'yellow')], TEXT)
+    assert memory.pairs(TEXT) == [('Oli', 'blue')]
+    assert memory.entries['oli']['confidence'] < NEW_CONFIDENCE
+    # Low confidence means the model gets asked again
+    assert memory.known_names(TEXT) == []
+
+    memory.update([('Oli', 'yellow')], TEXT)
+    assert memory.pairs(TEXT) == [('Oli', 'yellow')]
+    assert memory.entries['oli']['confidence'] == NEW_CONFIDENCE
+
+
+def test_agreement_raises_confidence():
+    memory = NameColourMemory()
+    memory.update([('Oli', 'blue')], TEXT)
+    memory.update([('oli', 'Blue')], TEXT)
+    assert memory.entries['oli']['confidence'] > NEW_CONFIDENCE
+    assert len(memory.entries) == 1
+
+
+def test_malformed_model_output_is_ignored():
+    memory = NameColourMemory()
+    memory.update("[('Oli', 'blue'", TEXT)
+    memory.update([('Oli',), 'Nay', ('', 'red')], TEXT)
+    assert memory.entries == {}
+
+
+def test_pairs_only_cover_names_in_the_text():
+    memory = NameColourMemory()
+    memory.update([('Oli', 'blue'), ('Nay', 'purple')], TEXT)
+    assert memory.pairs("Only Nay here") == [('Nay', 'purple')]
+
+
+def test_global_memory_seeds_documents_but_is_classified_once(tmp_path):
+    shared = NameColourMemory()
+    NameColourMemory(fallback=shared).update([('Oli', 'blue')], TEXT)
+
+    path = tmp_path / 'name_colours.json'
+    shared.save(str(path))
+    loaded = NameColourMemory()
+    loaded.load(str(path))
+
+    other_doc = NameColourMemory(fallback=loaded)
+    # Seeded colour is used, but context from another file can't be trusted
+    assert other_doc.known_names(TEXT) == []
+    assert other_doc.pairs(TEXT) == [('Oli', 'blue')]
+
+
+def test_memories_are_pruned_by_recency():
+    shared = NameColourMemory(max_entries=5)
+    memory = NameColourMemory(fallback=shared, max_entries=5)
+    for i in range(12):
+        memory.update([(f'Name{i}', 'red')], f'Name{i} is here')
+
+    assert len(memory.entries) == 5
+    assert len(shared.entries) == 5
+    assert 'name11' in shared.entries
+    assert 'name0' not in shared.entries
+
+
+def test_document_memory_reloads_with_context(tmp_path):
+    memory = NameColourMemory()
+    memory.update([('Oli', 'blue'), ('Nay', 'purple')], TEXT)
+
+    path = tmp_path / 'name_colours' / 'doc.json'
+    memory.save(str(path), with_context=True)
+    reopened = NameColourMemory()
+    reopened.load(str(path), with_context=True)
+
+    # Reopening the unchanged file doesn't send its names to the model again
+    assert sorted(reopened.known_names(TEXT)) == ['Nay', 'Oli']
+    assert reopened.known_names(TEXT + "\nOli is happy now") == ['Nay']
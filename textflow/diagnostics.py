@@ -0,0 +1,206 @@
+"""
+Diagnostics
+Shared by textflow.py (inside gedit) and llm_server.py (standalone process).
+
+Logging:
+    get_logger(name) returns a logger gated by TEXTFLOW_LOG_LEVEL (default WARNING).
+    Records are buffered in memory and written out in batches, or straight away for
+    WARNING and above, so hot paths don't pay for stdout I/O.
+
+Tracing:
+    Off unless TEXTFLOW_TRACE=1. The plugin assigns a correlation id per document
+    change and sends it to the server in the X-TextFlow-Trace-Id header, so spans
+    from both processes line up. Each process appends Chrome trace events to
+    logs/trace-<process>.json; open one directly in ui.perfetto.dev or
+    chrome://tracing, or merge both into a single timeline:
+
+        python3 diagnostics.py logs/trace-*.json -o logs/trace.json
+"""
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+TRACE_HEADER = 'X-TextFlow-Trace-Id'
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_logger(name: str, level=None) -> logging.Logger:
+    """Return a level-gated logger whose output is buffered until flushed"""
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+    set_log_level(logger, level or os.environ.get('TEXTFLOW_LOG_LEVEL', 'WARNING'))
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    logger.addHandler(logging.handlers.MemoryHandler(capacity=200, flushLevel=logging.WARNING, target=stream))
+    logger.propagate = False
+    return logger
+
+
+def set_log_level(logger: logging.Logger, level):
+    """Set a level by name, falling back to WARNING for names logging doesn't know"""
+    level = getattr(logging, str(level).strip().upper(), logging.WARNING)
+    logger.setLevel(level if isinstance(level, int) else logging.WARNING)
+
+
+def flush_logger(logger: logging.Logger):
+    for handler in logger.handlers:
+        handler.flush()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Tracer:
+    """
+    Collects spans as Chrome trace "complete" events and appends them to a file.
+    Timestamps are wall-clock microseconds so traces from separate processes merge cleanly.
+    When disabled every method is a cheap no-op.
+    """
+    def __init__(self, process_name: str, enabled=None, path=None, flush_every: int = 64, flush_interval: float = 2.0):
+        self.enabled = False
+        self.process_name = process_name
+        self.path = path or os.path.join(LOG_DIR, f'trace-{process_name}.json')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._events = []
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._file_started = False
+        if env_flag('TEXTFLOW_TRACE') if enabled is None else enabled:
+            self.enable()
+
+    def enable(self):
+        """Turn tracing on, e.g. once a config file asks for it. Safe to call repeatedly."""
+        with self._lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self._events.append({
+                'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                'args': {'name': self.process_name},
+            })
+
+    @staticmethod
+    def now() -> float:
+        return time.time()
+
+    def add_span(self, name: str, start: float, end: float, trace_id=None, **args):
+        """Record a span between two Tracer.now() timestamps"""
+        if not self.enabled:
+            return
+        if trace_id:
+            args['trace_id'] = trace_id
+        event = {
+            'name': name,
+            'cat': self.process_name,
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': max(0, int((end - start) * 1e6)),
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with self._lock:
+            self._events.append(event)
+            due = (len(self._events) >= self.flush_every
+                   or end - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    @contextmanager
+    def span(self, name: str, trace_id=None, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time(), trace_id, **args)
+
+    def flush(self):
+        """
+        Append buffered events to the trace file.
+        Uses the JSON array format without a closing bracket, which Chrome and Perfetto
+        both accept, so the file stays valid even if the process is killed.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            events, self._events = self._events, []
+            self._last_flush = time.time()
+            if not events:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                mode = 'a' if self._file_started else 'w'
+                with open(self.path, mode) as f:
+                    if not self._file_started:
+                        f.write('[\n')
+                    for event in events:
+                        f.write(json.dumps(event) + ',\n')
+                self._file_started = True
+            except OSError as e:
+                print(f"Failed to write trace file {self.path}: {e}", file=sys.stderr)
+
+
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+def get_tracer(process_name: str) -> Tracer:
+    """
+    The one Tracer for this process. gedit creates a plugin instance per window, and
+    separate Tracers on the same file would overwrite each other's spans.
+    """
+    with _tracers_lock:
+        if process_name not in _tracers:
+            _tracers[process_name] = Tracer(process_name)
+        return _tracers[process_name]
+
+
+def load_trace_events(path: str):
+    """Read a trace file written by Tracer, tolerating the missing closing bracket"""
+    with open(path) as f:
+        body = f.read().strip()
+    if body.startswith('['):
+        body = body[1:]
+    body = body.rstrip().rstrip(']').rstrip().rstrip(',')
+    return json.loads('[' + body + ']') if body else []
+
+
+def merge_traces(paths, out_path: str):
+    events = []
+    for path in paths:
+        events.extend(load_trace_events(path))
+    with open(out_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return len(events)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Merge TextFlow trace files into one Chrome/Perfetto trace')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('-o', '--output', default=os.path.join(LOG_DIR, 'trace.json'))
+    args = parser.parse_args()
+    count = merge_traces(args.paths, args.output)
+    print(f"Wrote {count} events to {args.output}")
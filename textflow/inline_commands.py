@@ -0,0 +1,211 @@
+"""
+InlineCommands
+Runs an LLM prompt for task lines that match a trigger pattern and writes the answer back
+into the buffer underneath the line.
+
+- A command fires once its line is complete, i.e. the cursor has left it (usually by pressing Enter).
+- Each trigger line gets one command, tracked by a Gtk.TextMark at the start of the line. While the
+  command is queued or running, or its last run failed, that line is skipped until its text changes;
+  so re-scanning on every keystroke is free, and identical lines elsewhere still get their own run.
+- Work runs on a small bounded executor. Beyond max_pending, commands wait in the queue and are
+  submitted as earlier ones finish.
+- The answer is inserted under the marked line, so it lands in the right place even if text above it
+  is edited meanwhile. If the line itself changed, the answer is discarded.
+- Answers are prefixed with RESULT_PREFIX; a trigger line already followed by one is skipped,
+  so reopening a file doesn't re-run its commands.
+
+Configured under [inline_commands] in the config file:
+    patterns    = one regex per line, checked in documents that have task lines
+                  (default: task lines saying "I see you")
+    prompt      = template for the prompt, {line} is the line without its leading "--";
+                  other literal braces must be doubled, or the default prompt is kept
+    max_workers = executor threads (default 1; the server serialises on model_lock anyway)
+    max_pending = commands allowed on the executor at once (default 4)
+"""
+import re
+import threading
+
+
+DEFAULT_PATTERNS = [r'(?i)^\s*--.*\bi see you\b']
+DEFAULT_PROMPT = '{line}'
+RESULT_PREFIX = '    ↳ '
+
+# Command states
+QUEUED = 'queued'      # waiting for room on the executor
+RUNNING = 'running'    # submitted; the answer will come back through _insert_result
+FAILED = 'failed'      # no answer; not retried until the line is edited
+
+
+class InlineCommands:
+    def __init__(self, infer, log, tracer, max_workers: int = 1, max_pending: int = 4, idle_add=None):
+        """
+        infer(prompt, trace_id) is called on a worker thread and returns the answer text or None.
+        idle_add schedules a callback on the main loop (GLib.idle_add by default).
+        """
+        if idle_add is None:
+            from gi.repository import GLib
+            idle_add = GLib.idle_add
+        self.infer = infer
+        self.idle_add = idle_add
+        self.log = log
+        self.tracer = tracer
+        self.patterns = [re.compile(p) for p in DEFAULT_PATTERNS]
+        self.prompt = DEFAULT_PROMPT
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._commands = {}   # id(doc) -> list of command dicts; main thread only
+
+    def configure(self, config):
+        section = 'inline_commands'
+        if not config.has_section(section):
+            return
+        patterns = [p.strip() for p in config.get(section, 'patterns', fallback='').splitlines() if p.strip()]
+        if patterns:
+            try:
+                self.patterns = [re.compile(p) for p in patterns]
+            except re.error as e:
+                self.log.warning("Invalid inline command pattern, keeping defaults: %s", e)
+        prompt = config.get(section, 'prompt', fallback=self.prompt)
+        try:
+            # Checked once here rather than failing in scan on every keystroke
+            prompt.format(line='')
+            self.prompt = prompt
+        except (KeyError, IndexError, ValueError) as e:
+            self.log.warning("Invalid inline command prompt %r, keeping the default: %s", prompt, e)
+        self.max_pending = config.getint(section, 'max_pending', fallback=self.max_pending)
+        if self._executor is None:
+            self.max_workers = config.getint(section, 'max_workers', fallback=self.max_workers)
+
+    def submit(self, fn, *args):
+        """Run fn on the bounded executor. Returns False if it is full."""
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            if self._executor is None:
+                # Imported here so plugin activation doesn't pay for it
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='textflow-inline')
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._on_done)
+        return True
+
+    def _on_done(self, future):
+        with self._pending_lock:
+            self._pending -= 1
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.log.warning("Inline command failed: %s", future.exception())
+        # Room on the executor: hand queued commands to it from the main thread
+        self.idle_add(self._submit_queued)
+
+    def scan(self, doc, text, trace_id=None):
+        """Start commands for completed trigger lines that don't have one yet. Main thread only."""
+        cursor_line = doc.get_iter_at_mark(doc.get_insert()).get_line()
+        lines = text.split('\n')
+        tracked = self._tracked_lines(doc, lines)
+        for line_no, line in enumerate(lines):
+            if line_no == cursor_line or line_no in tracked or not any(p.search(line) for p in self.patterns):
+                continue
+            if line_no + 1 < len(lines) and lines[line_no + 1].startswith(RESULT_PREFIX):
+                continue
+            command = {
+                'doc': doc,
+                'mark': doc.create_mark(None, doc.get_iter_at_line(line_no), True),
+                'line': line,
+                'prompt': self.prompt.format(line=line.strip().lstrip('-').strip()),
+                'trace_id': trace_id,
+                'state': QUEUED,
+            }
+            self._commands.setdefault(id(doc), []).append(command)
+            self._start(command)
+
+    def _tracked_lines(self, doc, lines):
+        """Line numbers whose command is still in play; commands for edited lines are dropped"""
+        tracked = set()
+        for command in list(self._commands.get(id(doc), [])):
+            line_no = doc.get_iter_at_mark(command['mark']).get_line()
+            if line_no < len(lines) and lines[line_no] == command['line']:
+                tracked.add(line_no)
+            elif command['state'] != RUNNING:
+                # A running command is cleaned up when its answer arrives
+                self._drop(command)
+        return tracked
+
+    def _start(self, command):
+        if self.submit(self._run, command):
+            command['state'] = RUNNING
+        else:
+            self.log.debug("Inline command queue full, waiting: %s", command['line'])
+
+    def _submit_queued(self):
+        for commands in self._commands.values():
+            for command in commands:
+                if command['state'] == QUEUED:
+                    self._start(command)
+                    if command['state'] == QUEUED:
+                        return False
+        return False  # Remove idle handler
+
+    def _drop(self, command):
+        if not command['mark'].get_deleted():
+            command['doc'].delete_mark(command['mark'])
+        commands = self._commands.get(id(command['doc']), [])
+        if command in commands:
+            commands.remove(command)
+
+    def _run(self, command):
+        # ❌ NO GTK CALLS HERE
+        result = None
+        try:
+            result = self.infer(command['prompt'], command['trace_id'])
+        except Exception as e:
+            self.log.warning("Inline command failed: %s", e)
+        finally:
+            # Always report back, so a failure ends up FAILED rather than RUNNING forever
+            self.idle_add(self._insert_result, command, result)
+
+    def _insert_result(self, command, result):
+        # ✅ Safe to touch GTK here
+        doc, mark, line = command['doc'], command['mark'], command['line']
+        with self.tracer.span('insert_inline_result', command['trace_id']):
+            if mark.get_deleted():
+                # Document was forgotten while we waited
+                return False
+            start = doc.get_iter_at_mark(mark)
+            end = start.copy()
+            if not end.ends_line():
+                end.forward_to_line_end()
+            if doc.get_text(start, end, False) != line:
+                self.log.info("Line changed before inline result arrived, discarding: %s", line)
+                self._drop(command)
+            elif result:
+                answer = ' '.join(result.split('\n'))
+                # The answer line now marks this command as done
+                self._drop(command)
+                doc.begin_user_action()
+                doc.insert(end, '\n' + RESULT_PREFIX + answer)
+                doc.end_user_action()
+            else:
+                command['state'] = FAILED
+        return False  # Remove idle handler
+
+    def forget(self, doc):
+        """Drop every command for a document that is going away"""
+        for command in list(self._commands.get(id(doc), [])):
+            self._drop(command)
+        self._commands.pop(id(doc), None)
+
+    def shutdown(self):
+        for commands in list(self._commands.values()):
+            for command in list(commands):
+                self._drop(command)
+        self._commands.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,8 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, has_request_context
 """
 LLMServer
 Compact Flask server managing a single llama_cpp.Llama model (thread-safe via Lock).
-Endpoints: /health, /load_model, /unload_model, /inference, /extract_names.
+Endpoints: /health, /metrics, /load_model, /unload_model, /inference, /extract_names.
 Uses a YAML prompts file with key "extract_names" for name extraction.
 
 Quick curl examples:
@@ -23,33 +23,121 @@ Quick curl examples:
     curl -X POST http://localhost:19953/extract_names \
       -H "Content-Type: application/json" \
       -d '{"text":"Alice and Bob...","prompts_path":"textflow/prompts.yaml"}'
+
+    Add "known_names":["Alice"] to skip names the client has already coloured
+    (uses the "extract_new_names" prompt).
+
+5) Metrics (JSON, or Prometheus text with ?format=prometheus):
+    curl -s http://localhost:19953/metrics
+    curl -s "http://localhost:19953/metrics?format=prometheus"
+
+Logging is gated by TEXTFLOW_LOG_LEVEL and tracing by TEXTFLOW_TRACE (see diagnostics.py).
+Requests carrying an X-TextFlow-Trace-Id header have their spans tagged with that id.
 """
 from llama_cpp import Llama
+import llama_cpp
 import json
 import yaml
 import os
 from threading import Lock
+from contextlib import contextmanager
 import ast
+import time
+import signal
+import sys
+from diagnostics import get_logger, flush_logger, get_tracer, TRACE_HEADER
+from metrics import ServerMetrics
+import atexit
+
+
+log = get_logger('textflow.server')
 
 
+def llama_perf_ms(llm: Llama):
+    """Cumulative (prompt eval ms, generation ms) from llama.cpp, or None if this build doesn't expose them"""
+    try:
+        data = llama_cpp.llama_perf_context(llm._ctx.ctx)
+        return data.t_p_eval_ms, data.t_eval_ms
+    except Exception:
+        return None
+
 
 class LLMServer:
     def __init__(self):
         self.app = Flask(__name__)
         self.current_model = None
         self.model_lock = Lock()
+        self.metrics = ServerMetrics()
+        self.tracer = get_tracer('llm_server')
+        atexit.register(self.tracer.flush)
+        atexit.register(flush_logger, log)
         self.register_routes()
         self.this_dir = os.path.dirname(os.path.abspath(__file__))
 
+    @staticmethod
+    def trace_id():
+        """Correlation id sent by the plugin for the current request, if any"""
+        return g.get('trace_id') if has_request_context() else None
+
+    @contextmanager
+    def locked_model(self):
+        """Acquire model_lock, recording time spent waiting for it versus holding it"""
+        requested = time.perf_counter()
+        wall_requested = self.tracer.now()
+        with self.model_lock:
+            acquired = time.perf_counter()
+            wall_acquired = self.tracer.now()
+            try:
+                yield
+            finally:
+                self.metrics.observe_lock(acquired - requested, time.perf_counter() - acquired)
+                self.tracer.add_span('lock_wait', wall_requested, wall_acquired, self.trace_id())
+                self.tracer.add_span('lock_hold', wall_acquired, self.tracer.now(), self.trace_id())
+
+    def generate(self, llm: Llama, prompt: str, **kwargs):
+        """Run a completion and record its token usage"""
+        started = time.perf_counter()
+        wall_started = self.tracer.now()
+        perf_before = llama_perf_ms(llm) if self.tracer.enabled else None
+        response = llm(prompt, **kwargs)
+        self.metrics.observe_generation(response, time.perf_counter() - started)
+        if self.tracer.enabled:
+            self.trace_generation(llm, response, wall_started, perf_before)
+        return response
+
+    def trace_generation(self, llm: Llama, response, started: float, perf_before):
+        """
+        Split a finished completion into prompt_eval and generation spans using llama.cpp's
+        perf counters. Falls back to a single completion span if they aren't available.
+        """
+        ended = self.tracer.now()
+        usage = (response.get('usage') or {}) if isinstance(response, dict) else {}
+        perf_after = llama_perf_ms(llm)
+        if perf_before is None or perf_after is None:
+            self.tracer.add_span('completion', started, ended, self.trace_id(), **usage)
+            return
+        prompt_ms = perf_after[0] - perf_before[0]
+        if prompt_ms < 0:
+            # Counters were reset during the call
+            prompt_ms = perf_after[0]
+        split = min(ended, started + prompt_ms / 1000)
+        self.tracer.add_span('prompt_eval', started, split, self.trace_id(),
+                             prompt_tokens=usage.get('prompt_tokens'))
+        self.tracer.add_span('generation', split, ended, self.trace_id(),
+                             completion_tokens=usage.get('completion_tokens'))
+
     def load_model(self, model_path: str):
         """Load a GGUF model using llama.cpp"""
-        return Llama(
+        started = time.perf_counter()
+        llm = Llama(
             model_path=model_path,
             n_ctx=4096,
             n_threads=16,
             n_gpu_layers=-1,  # offload all layers to GPU
             verbose=False, 
         )
+        self.metrics.observe_model_load(time.perf_counter() - started)
+        return llm
 
     def unload_model(self, llm):
         """Unload model and free memory"""
@@ -61,18 +149,29 @@ class LLMServer:
         with open(yaml_path, 'r') as f:
             return yaml.safe_load(f)
 
-    def extract_names(self, text: str, llm: Llama, prompts_path: str):
-        """Extract person names from text using LLM"""
+    def extract_names(self, text: str, llm: Llama, prompts_path: str, known_names=None):
+        """Extract person names from text using LLM, skipping any in known_names"""
         prompts = self.load_prompts(prompts_path)
-        prompt = prompts['extract_names'].format(text=text)
-        response = llm(
+        if known_names and 'extract_new_names' in prompts:
+            prompt = prompts['extract_new_names'].format(text=text, known=', '.join(known_names))
+        else:
+            prompt = prompts['extract_names'].format(text=text)
+        response = self.generate(
+            llm,
             prompt,
             max_tokens=256,
             temperature=0.3,
             stop=["</s>", "\n\n"],
         )
 
-        print('\n text: \n', response)
+        log.debug("extract_names raw response: %s", response)
+        parse_started = self.tracer.now()
+        names = self.parse_names(response)
+        self.tracer.add_span('parse', parse_started, self.tracer.now(), self.trace_id())
+        return names
+
+    def parse_names(self, response):
+        """Pull the list of (name, colour) tuples out of a completion"""
         if isinstance(response, dict) and 'choices' in response:
             response_text = response['choices'][0]['text'].strip()
         elif isinstance(response, str):
@@ -88,17 +187,48 @@ class LLMServer:
                 try:
                     names = ast.literal_eval(list_str)
                 except Exception as e:
-                    print(f"Failed to parse list with ast.literal_eval: {e}")
+                    log.warning("Failed to parse list with ast.literal_eval: %s", e)
+                    self.metrics.observe_parse_failure()
                     names = list_str  # fallback: return as string
             else:
+                self.metrics.observe_parse_failure()
                 names = response_text  # fallback: return as string
             return names
         except Exception as e:
-            print(f"Failed to extract names (possibly due to looking for a list brackets): {e}")
+            log.warning("Failed to extract names (possibly due to looking for a list brackets): %s", e)
+            self.metrics.observe_parse_failure()
             return []
 
     def register_routes(self):
         app = self.app
+
+        @app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+            g.request_started_wall = self.tracer.now()
+            g.trace_id = request.headers.get(TRACE_HEADER)
+
+        @app.after_request
+        def record_request(response):
+            started = g.get('request_started')
+            if started is not None and request.endpoint != 'metrics':
+                # Label by route rule rather than raw path so unknown URLs can't grow the label set
+                endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+                self.metrics.observe_request(endpoint, time.perf_counter() - started, response.status_code)
+                self.tracer.add_span(f'server {endpoint}', g.request_started_wall, self.tracer.now(),
+                                     g.trace_id, status=response.status_code)
+            if self.tracer.enabled:
+                # Write this request's spans and logs now; they're what a trace of a slow request is after
+                self.tracer.flush()
+                flush_logger(log)
+            return response
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics():
+            model_loaded = self.current_model is not None
+            if request.args.get('format') == 'prometheus':
+                return Response(self.metrics.to_prometheus(model_loaded), mimetype='text/plain; version=0.0.4')
+            return jsonify(self.metrics.snapshot(model_loaded))
         
         @app.route('/health', methods=['GET'])
         def health_check():
@@ -113,10 +243,7 @@ class LLMServer:
             data = request.get_json()
             message = data.get('message') if data else None
             import sys
-            print("Health check called.")
-            print(f"VIRTUAL_ENV: {sys.prefix}")
-            print(f"BASE_PREFIX: {sys.base_prefix}")
-            print(f"Current working directory: {cwd}")
+            log.info("checkcwd called. VIRTUAL_ENV: %s BASE_PREFIX: %s cwd: %s", sys.prefix, sys.base_prefix, cwd)
             return jsonify({
                 'status': 'ok',
                 'message': message + sys.prefix + 'yes' + sys.base_prefix if message else '',
@@ -128,16 +255,15 @@ class LLMServer:
             if not data or 'model_path' not in data:
                 return jsonify({'error': 'model_path is required'}), 400
             model_path = data['model_path']
-            print(f"Loading model from path: {model_path}")
+            log.info("Loading model from path: %s", model_path)
             if not os.path.exists(model_path):
                 return jsonify({'error': f'Model file not found: {model_path}'}), 404
             try:
-                with self.model_lock:
+                with self.locked_model():
                     if self.current_model is not None:
                         self.unload_model(self.current_model)
                     self.current_model = self.load_model(model_path)
-                    print('HERE')
-                    print(self.current_model)
+                    log.info("Model loaded: %s", self.current_model)
                 return jsonify({
                     'status': 'success',
                     'message': f'Model loaded from {model_path} ',
@@ -148,7 +274,7 @@ class LLMServer:
         @app.route('/unload_model', methods=['POST'])
         def unload_model_endpoint():
             try:
-                with self.model_lock:
+                with self.locked_model():
                     if self.current_model is None:
                         return jsonify({'message': 'No model loaded'}), 200
                     self.unload_model(self.current_model)
@@ -168,14 +294,14 @@ class LLMServer:
             if not data or 'text' not in data:
                 return jsonify({'error': 'text is required'}), 400
             text = data['text']
+            known_names = data.get('known_names') or []
             prompts_path = data.get('prompts_path', self.this_dir + '/prompts.yaml')
-            print('here')
-            print(prompts_path)
+            log.debug("extract_names using prompts file %s", prompts_path)
             if not os.path.exists(prompts_path):
                 return jsonify({'error': f'Prompts file not found: {prompts_path}'}), 404
             try:
-                with self.model_lock:
-                    names = self.extract_names(text, self.current_model, prompts_path)
+                with self.locked_model():
+                    names = self.extract_names(text, self.current_model, prompts_path, known_names)
                 return jsonify({
                     'status': 'success',
                     'names': names
@@ -195,8 +321,9 @@ class LLMServer:
             temperature = data.get('temperature', 0.3)
             stop = data.get('stop', ["</s>", "\n\n"])
             try:
-                with self.model_lock:
-                    response = self.current_model(
+                with self.locked_model():
+                    response = self.generate(
+                        self.current_model,
                         prompt,
                         max_tokens=max_tokens,
                         temperature=temperature,
@@ -216,7 +343,14 @@ class LLMServer:
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
 
+    def flush_and_exit(self, signum, frame):
+        """SIGTERM handler: write out buffered spans and logs before the plugin's stop takes effect"""
+        self.tracer.flush()
+        flush_logger(log)
+        sys.exit(0)
+
     def run(self):
+        signal.signal(signal.SIGTERM, self.flush_and_exit)
         self.app.run(host='0.0.0.0', port=19953, debug=False, threaded=True)
 
 if __name__ == '__main__':
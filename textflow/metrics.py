@@ -0,0 +1,195 @@
+"""
+ServerMetrics
+In-process counters behind llm_server.py's /metrics endpoint.
+Kept free of flask/llama_cpp imports so it can be used and tested on its own.
+"""
+from threading import Lock
+import bisect
+import resource
+import time
+
+
+# Upper bounds of the histogram buckets, Prometheus style. Each histogram has an extra +Inf slot.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def new_histogram(bounds):
+    return {'bounds': bounds, 'count': 0, 'sum': 0.0, 'buckets': [0] * (len(bounds) + 1)}
+
+
+def observe_histogram(histogram, value):
+    histogram['count'] += 1
+    histogram['sum'] += value
+    # Last slot is the +Inf bucket
+    histogram['buckets'][bisect.bisect_left(histogram['bounds'], value)] += 1
+
+
+def histogram_snapshot(histogram):
+    labels = [str(b) for b in histogram['bounds']] + ['+Inf']
+    return {'count': histogram['count'], 'sum': histogram['sum'], 'buckets': dict(zip(labels, histogram['buckets']))}
+
+
+def histogram_samples(snapshot, labels=''):
+    """Prometheus _bucket/_sum/_count samples for a histogram_snapshot(); labels is e.g. 'endpoint="/x",'"""
+    samples = []
+    cumulative = 0
+    for le, n in snapshot['buckets'].items():
+        cumulative += n
+        samples.append((f'_bucket{{{labels}le="{le}"}}', cumulative))
+    suffix = f'{{{labels.rstrip(",")}}}' if labels else ''
+    samples.append((f'_sum{suffix}', snapshot['sum']))
+    samples.append((f'_count{suffix}', snapshot['count']))
+    return samples
+
+
+class ServerMetrics:
+    """
+    Every update is a few additions under a private lock, so it is cheap enough to leave on.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.started_at = time.time()
+        self.requests = {}        # endpoint -> {'errors', 'latency': histogram}
+        self.lock_wait_seconds = 0.0
+        self.lock_hold_seconds = 0.0
+        self.lock_acquisitions = 0
+        self.generation_seconds = 0.0
+        self.prompt_tokens = new_histogram(TOKEN_BUCKETS)
+        self.completion_tokens = new_histogram(TOKEN_BUCKETS)
+        self.tokens_per_second = new_histogram(TOKENS_PER_SECOND_BUCKETS)
+        self.generations_without_usage = 0
+        self.model_load_seconds = None
+        self.model_loads = 0
+        self.parse_failures = 0
+
+    def observe_request(self, endpoint: str, seconds: float, status_code: int):
+        with self._lock:
+            stats = self.requests.get(endpoint)
+            if stats is None:
+                stats = {'errors': 0, 'latency': new_histogram(LATENCY_BUCKETS)}
+                self.requests[endpoint] = stats
+            if status_code >= 400:
+                stats['errors'] += 1
+            observe_histogram(stats['latency'], seconds)
+
+    def observe_lock(self, wait_seconds: float, hold_seconds: float):
+        with self._lock:
+            self.lock_wait_seconds += wait_seconds
+            self.lock_hold_seconds += hold_seconds
+            self.lock_acquisitions += 1
+
+    def observe_generation(self, response, seconds: float):
+        """Record per-request token usage from a llama_cpp completion dict; responses without usage are only counted"""
+        usage = response.get('usage') if isinstance(response, dict) else None
+        with self._lock:
+            if not usage:
+                self.generations_without_usage += 1
+                return
+            completion_tokens = usage.get('completion_tokens', 0)
+            self.generation_seconds += seconds
+            observe_histogram(self.prompt_tokens, usage.get('prompt_tokens', 0))
+            observe_histogram(self.completion_tokens, completion_tokens)
+            if seconds > 0:
+                observe_histogram(self.tokens_per_second, completion_tokens / seconds)
+
+    def observe_model_load(self, seconds: float):
+        with self._lock:
+            self.model_load_seconds = seconds
+            self.model_loads += 1
+
+    def observe_parse_failure(self):
+        with self._lock:
+            self.parse_failures += 1
+
+    @staticmethod
+    def resident_memory_bytes():
+        """Current RSS from /proc, falling back to peak RSS where /proc is unavailable"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except (OSError, ValueError, IndexError):
+            # ru_maxrss is in KiB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def snapshot(self, model_loaded: bool):
+        with self._lock:
+            requests = {
+                endpoint: {'errors': stats['errors'], 'latency_seconds': histogram_snapshot(stats['latency'])}
+                for endpoint, stats in self.requests.items()
+            }
+            completion_total = self.completion_tokens['sum']
+            return {
+                'uptime_seconds': time.time() - self.started_at,
+                'model_loaded': model_loaded,
+                'model_load_seconds': self.model_load_seconds,
+                'model_loads': self.model_loads,
+                'resident_memory_bytes': self.resident_memory_bytes(),
+                'requests': requests,
+                'model_lock': {
+                    'acquisitions': self.lock_acquisitions,
+                    'wait_seconds_total': self.lock_wait_seconds,
+                    'hold_seconds_total': self.lock_hold_seconds,
+                },
+                'tokens': {
+                    'prompt_per_request': histogram_snapshot(self.prompt_tokens),
+                    'completion_per_request': histogram_snapshot(self.completion_tokens),
+                    'tokens_per_second': histogram_snapshot(self.tokens_per_second),
+                    'generation_seconds_total': self.generation_seconds,
+                    'tokens_per_second_avg': (completion_total / self.generation_seconds
+                                              if self.generation_seconds > 0 else 0.0),
+                    'generations_without_usage': self.generations_without_usage,
+                },
+                'extract_names_parse_failures': self.parse_failures,
+            }
+
+    def to_prometheus(self, model_loaded: bool):
+        """Render a snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot(model_loaded)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP textflow_{name} {help_text}')
+            lines.append(f'# TYPE textflow_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'textflow_{name}{labels} {value}')
+
+        metric('uptime_seconds', 'gauge', 'Seconds since the server started.', [('', snap['uptime_seconds'])])
+        metric('model_loaded', 'gauge', 'Whether a model is loaded.', [('', int(model_loaded))])
+        metric('model_load_seconds', 'gauge', 'Duration of the last model load.',
+               [('', snap['model_load_seconds'] or 0)])
+        metric('resident_memory_bytes', 'gauge', 'Resident memory of the server process.',
+               [('', snap['resident_memory_bytes'])])
+
+        count_samples, error_samples, latency_samples = [], [], []
+        for endpoint, stats in snap['requests'].items():
+            count_samples.append((f'{{endpoint="{endpoint}"}}', stats['latency_seconds']['count']))
+            error_samples.append((f'{{endpoint="{endpoint}"}}', stats['errors']))
+            latency_samples.extend(histogram_samples(stats['latency_seconds'], f'endpoint="{endpoint}",'))
+        metric('requests_total', 'counter', 'Requests handled per endpoint.', count_samples)
+        metric('request_errors_total', 'counter', 'Requests per endpoint that returned a 4xx/5xx.', error_samples)
+        metric('request_latency_seconds', 'histogram', 'Request latency per endpoint.', latency_samples)
+
+        lock = snap['model_lock']
+        metric('model_lock_acquisitions_total', 'counter', 'Times model_lock was acquired.',
+               [('', lock['acquisitions'])])
+        metric('model_lock_wait_seconds_total', 'counter', 'Time spent waiting for model_lock.',
+               [('', lock['wait_seconds_total'])])
+        metric('model_lock_hold_seconds_total', 'counter', 'Time spent holding model_lock.',
+               [('', lock['hold_seconds_total'])])
+
+        tokens = snap['tokens']
+        metric('prompt_tokens', 'histogram', 'Prompt tokens evaluated per request.',
+               histogram_samples(tokens['prompt_per_request']))
+        metric('completion_tokens', 'histogram', 'Completion tokens generated per request.',
+               histogram_samples(tokens['completion_per_request']))
+        metric('tokens_per_second', 'histogram', 'Generation throughput per request.',
+               histogram_samples(tokens['tokens_per_second']))
+        metric('generation_seconds_total', 'counter', 'Time spent inside model calls that reported usage.',
+               [('', tokens['generation_seconds_total'])])
+        metric('generations_without_usage_total', 'counter', 'Model calls whose response had no usage data.',
+               [('', tokens['generations_without_usage'])])
+        metric('extract_names_parse_failures_total', 'counter', 'extract_names responses that did not parse as a list.',
+               [('', snap['extract_names_parse_failures'])])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,147 @@
+"""
+NameColourMemory
+Remembers the colour the LLM gave each name, so colours stay stable between extractions
+and the model is only asked about names that are new or whose context has changed.
+
+Each entry keeps:
+    name        - display form as the model returned it
+    colour      - current colour
+    confidence  - 0..1; goes up when the model agrees, down when it disagrees.
+                  The colour only switches once confidence runs out, so one odd
+                  answer doesn't make a name flicker.
+    last_seen   - time the name was last present in the text (used for pruning)
+    context     - signature of the lines mentioning the name when it was last classified
+
+One memory is kept per document and saved as JSON (with context) keyed by the file's
+location, so reopening a file doesn't re-classify its names. An optional global memory
+(saved without context) seeds per-document entries for names seen in other files.
+"""
+import json
+import os
+import re
+import time
+import zlib
+
+
+NEW_CONFIDENCE = 0.5
+CONFIDENCE_STEP = 0.25
+# Names at or above this confidence with unchanged context are not re-sent to the model
+STABLE_CONFIDENCE = 0.5
+
+
+class NameColourMemory:
+    def __init__(self, fallback=None, max_entries: int = 500):
+        self.entries = {}
+        self.fallback = fallback
+        self.max_entries = max_entries
+
+    @staticmethod
+    def context_for(name: str, text: str):
+        """Signature of every line that mentions the name; stable across runs so it can be saved"""
+        pattern = re.compile(re.escape(name), re.IGNORECASE)
+        lines = [line.strip().lower() for line in text.split('\n') if pattern.search(line)]
+        return zlib.crc32('\n'.join(lines).encode('utf-8')) if lines else None
+
+    def lookup(self, name: str):
+        key = name.lower()
+        entry = self.entries.get(key)
+        if entry is None and self.fallback is not None:
+            seed = self.fallback.entries.get(key)
+            if seed is not None:
+                # Context isn't comparable across documents, so it has to be classified here once
+                entry = dict(seed, context=None)
+                self.entries[key] = entry
+        return entry
+
+    def present_names(self, text: str):
+        """Stored names that occur in the text"""
+        lowered = text.lower()
+        return [key for key in self.entries if key in lowered]
+
+    def known_names(self, text: str):
+        """Names the model can skip: stable colour and the lines mentioning them are unchanged"""
+        if self.fallback is not None:
+            lowered = text.lower()
+            for key in self.fallback.entries:
+                if key in lowered:
+                    self.lookup(key)
+        known = []
+        for key in self.present_names(text):
+            entry = self.entries[key]
+            if entry['confidence'] >= STABLE_CONFIDENCE and entry['context'] == self.context_for(entry['name'], text):
+                known.append(entry['name'])
+        return known
+
+    def update(self, pairs, text: str):
+        """Merge (name, colour) pairs returned by the model"""
+        if not isinstance(pairs, list):
+            return
+        now = time.time()
+        for pair in pairs:
+            if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                continue
+            name, colour = str(pair[0]).strip(), str(pair[1]).strip().lower()
+            if not name:
+                continue
+            entry = self.lookup(name)
+            if entry is None:
+                entry = {'name': name, 'colour': colour, 'confidence': NEW_CONFIDENCE}
+                self.entries[name.lower()] = entry
+            elif entry['colour'] == colour:
+                entry['confidence'] = min(1.0, entry['confidence'] + CONFIDENCE_STEP)
+            else:
+                entry['confidence'] -= CONFIDENCE_STEP
+                if entry['confidence'] <= 0:
+                    entry['colour'] = colour
+                    entry['confidence'] = NEW_CONFIDENCE
+            entry['last_seen'] = now
+            entry['context'] = self.context_for(name, text)
+            if self.fallback is not None:
+                self.fallback.remember(entry)
+        for key in self.present_names(text):
+            self.entries[key]['last_seen'] = now
+        self.prune()
+
+    def remember(self, entry):
+        """Copy an entry in from another memory or a saved file, without its context"""
+        self.entries[entry['name'].lower()] = {
+            'name': entry['name'],
+            'colour': entry['colour'],
+            'confidence': entry.get('confidence', NEW_CONFIDENCE),
+            'last_seen': entry.get('last_seen', time.time()),
+            'context': None,
+        }
+        self.prune()
+
+    def pairs(self, text: str):
+        """(name, colour) pairs for names present in the text, as add_dynamic_tags expects"""
+        return [(self.entries[key]['name'], self.entries[key]['colour']) for key in self.present_names(text)]
+
+    def prune(self):
+        if len(self.entries) <= self.max_entries:
+            return
+        # Newest first; ties (same clock tick) keep the most recently added
+        by_recency = sorted(reversed(list(self.entries)), key=lambda key: self.entries[key].get('last_seen', 0),
+                            reverse=True)
+        for key in by_recency[self.max_entries:]:
+            del self.entries[key]
+
+    def load(self, path, with_context: bool = False):
+        """Load saved entries; with_context keeps context signatures (per-document files only)"""
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for entry in data.get('names', []):
+            if 'name' in entry and 'colour' in entry:
+                self.remember(entry)
+                if with_context and entry['name'].lower() in self.entries:
+                    self.entries[entry['name'].lower()]['context'] = entry.get('context')
+
+    def save(self, path, with_context: bool = False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        names = [{k: v for k, v in entry.items() if with_context or k != 'context'}
+                 for entry in self.entries.values()]
+        with open(path, 'w') as f:
+            json.dump({'names': names}, f, indent=1)
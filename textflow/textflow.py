@@ -1,33 +1,90 @@
+import time
+_import_started = time.perf_counter()
+
 from gi.repository import GObject, Gedit, Gtk, GLib
 
 #from llm_utils import load_model
 import threading
-import requests
-import subprocess
+import logging
 import re
 import os
-import time
+# requests, subprocess and configparser are imported where they're used, so
+# activating the plugin doesn't pay for them until the LLM is actually needed.
 
 
-import configparser
 from pathlib import Path
 
+from .diagnostics import get_logger, set_log_level, flush_logger, env_flag, get_tracer, new_trace_id, TRACE_HEADER
+from .name_memory import NameColourMemory
+from .inline_commands import InlineCommands
+
 CONFIG_DIR = Path.home() / ".config" / "myplugin"
 CONFIG_FILE = CONFIG_DIR / "config.ini"
 
-config = configparser.ConfigParser()
+# Lines starting with "--" are tasks; the first one seen in a document starts the LLM server
+TASK_LINE_RE = re.compile(r'^\s*--', re.MULTILINE)
+
+# How long inference waits for the model to finish loading before giving up
+MODEL_READY_TIMEOUT = 120
+
+# How long the server gets to flush and exit after SIGTERM before it is killed
+SERVER_STOP_TIMEOUT = 1.0
 
-models_dir = None
+log = get_logger("textflow.plugin")
 
-if CONFIG_FILE.exists():
-    config.read(CONFIG_FILE)
-    models_dir = config.get("models", "path", fallback=None)
+# gedit makes a plugin instance per window; they all share one global name memory per file,
+# so the last window to close doesn't overwrite what the others learned. Main thread only.
+_global_name_memories = {}
 
-if models_dir:
-    models_dir = Path(models_dir).expanduser()
-else:
+
+def load_config():
+    """Read the user config. Deferred until the LLM is first needed."""
+    import configparser
+    config = configparser.ConfigParser()
+    if CONFIG_FILE.exists():
+        config.read(CONFIG_FILE)
+
+    # Diagnostics settings go into the environment so the LLM server we spawn inherits them
+    if config.has_section("diagnostics"):
+        os.environ.setdefault("TEXTFLOW_LOG_LEVEL", config.get("diagnostics", "log_level", fallback="WARNING"))
+        os.environ.setdefault("TEXTFLOW_TRACE", config.get("diagnostics", "trace", fallback="0"))
+        set_log_level(log, os.environ["TEXTFLOW_LOG_LEVEL"])
+    return config
+
+
+def process_alive(pid: int) -> bool:
+    """True while pid is running; an exited process left as a zombie counts as gone"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # State is the field after the parenthesised command name
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def resolve_models_dir(config=None):
+    models_dir = config.get("models", "path", fallback=None) if config is not None else None
+    if models_dir:
+        return Path(models_dir).expanduser()
     # fallback to default
-    models_dir = Path(__file__).resolve().parent / "models" 
+    return Path(__file__).resolve().parent / "models"
+
+
+def global_name_memory(path):
+    """The process-wide global name memory saved at path, loaded on first use"""
+    key = str(path)
+    if key not in _global_name_memories:
+        memory = NameColourMemory()
+        memory.load(path)
+        _global_name_memories[key] = memory
+    return _global_name_memories[key]
 
 
 
@@ -43,12 +100,22 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
         self._handlers = {}
         self._tags_created = set()
         self._llm = None
-        self.llm_names = []
+        self._name_memories = {}
+        self.global_names = None
+        self.global_names_path = None
+        self.document_names_dir = None
         self.this_dir = os.path.dirname(__file__)
-        self.models_dir = models_dir
+        self.models_dir = None
+        self.tracer = get_tracer('gedit_plugin')
+        self._llm_requested = False
+        self._model_ready = threading.Event()
+        self.inline_commands = InlineCommands(self.infer, log, self.tracer)
+        self.activation_seconds = None
+        self._activation_span = None
+        self._activation_reported = False
+        self._pending_change_since = None
 
-        print('This dir')
-        print(self.this_dir)
+        log.debug("This dir: %s", self.this_dir)
 
 
         self.time_check = time.time()
@@ -56,30 +123,90 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
     ## On start
 
     def do_activate(self):
-        print("TextFlow activated!")
-        
-        self.load_llm_async()
+        started = time.perf_counter()
+        wall_started = self.tracer.now()
+
+        # Fast start: highlighting is live straight away, the LLM server waits for the first task line
+        if env_flag('TEXTFLOW_EAGER_START'):
+            self.ensure_llm()
 
         self._handlers['tab-added'] = self.window.connect('tab-added', self.on_tab_added)
+        self._handlers['tab-removed'] = self.window.connect('tab-removed', self.on_tab_removed)
         
         for doc in self.window.get_documents():
             self.connect_document(doc)
 
+        self.activation_seconds = time.perf_counter() - started
+        self._activation_span = (wall_started, self.tracer.now())
+        self.report_activation()
+
+    def report_activation(self):
+        """
+        Log and trace activation cost, once. If only the config file turns on INFO logging
+        or tracing, that isn't known until ensure_llm reads it, so it's reported from there.
+        """
+        if self._activation_reported or self._activation_span is None:
+            return
+        if not (self.tracer.enabled or log.isEnabledFor(logging.INFO)):
+            return
+        self._activation_reported = True
+        self.tracer.add_span('do_activate', *self._activation_span)
+        log.info("TextFlow activated in %.1f ms (module import %.1f ms)",
+                 self.activation_seconds * 1e3, MODULE_IMPORT_SECONDS * 1e3)
+
+    def ensure_llm(self):
+        """Read config and start the LLM server the first time a document needs it"""
+        if self._llm_requested:
+            return
+        import configparser
+        self.models_dir = resolve_models_dir()
+        self.document_names_dir = CONFIG_DIR / "name_colours"
+        # A bad config value shouldn't stop the LLM from ever starting; keep defaults for what's left
+        try:
+            config = load_config()
+            self.models_dir = resolve_models_dir(config)
+            if config.getboolean("names", "global_memory", fallback=False):
+                self.global_names_path = Path(config.get("names", "global_path",
+                                                         fallback=str(CONFIG_DIR / "name_colours.json"))).expanduser()
+                self.global_names = global_name_memory(self.global_names_path)
+            if not config.getboolean("names", "document_memory", fallback=True):
+                self.document_names_dir = None
+            self.inline_commands.configure(config)
+        except (configparser.Error, ValueError) as e:
+            log.warning("Invalid setting in %s, using defaults: %s", CONFIG_FILE, e)
+        if env_flag('TEXTFLOW_TRACE'):
+            self.tracer.enable()
+        self.report_activation()
+        self._llm_requested = True
+        log.info("First task line seen; starting LLM server")
+        self.load_llm_async()
+
 
 
     ## on close
 
     def do_deactivate(self):
-        print("TextFlow deactivated!")
-
-        print(os.getcwd())
+        log.info("TextFlow deactivated! cwd: %s", os.getcwd())
         
-        # Stop LLM server on deactivation
-        self.stop_llm_server()
+        # Stop LLM server on deactivation, if this window ever started one
+        if self._llm_requested:
+            self.stop_llm_server()
         
         for handler_id in self._handlers.values():
             self.window.disconnect(handler_id)
         self._handlers.clear()
+        self.inline_commands.shutdown()
+
+        for doc in self.window.get_documents():
+            self.save_name_memory(doc)
+        if self.global_names is not None:
+            try:
+                self.global_names.save(self.global_names_path)
+            except OSError as e:
+                log.warning("Failed to save name colours to %s: %s", self.global_names_path, e)
+
+        self.tracer.flush()
+        flush_logger(log)
 
 
 
@@ -94,13 +221,15 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
         start = doc.get_start_iter()
         end = doc.get_end_iter()
         text = doc.get_text(start, end, False)
+
+        if TASK_LINE_RE.search(text):
+            self.ensure_llm()
         
-        if text.strip():  # Only if there's content
-            names = self.extract_names_async(text)
-            print(f"Extracted names: {names}")
-            # TODO: Store names and assign colors
+        # Only if there's content and the server has been set up
+        if text.strip() and hasattr(self, 'llm_server_url'):
+            self.extract_names_async(text, doc=doc)
         
-        print(f"Connected to document")
+        log.debug("Connected to document")
 
     def do_update_state(self):
         pass
@@ -109,6 +238,14 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
         doc = tab.get_document()
         self.connect_document(doc)
 
+    def on_tab_removed(self, window, tab):
+        # Per-document state is keyed by id(doc), which a later document can reuse
+        doc = tab.get_document()
+        self.save_name_memory(doc)
+        self._name_memories.pop(id(doc), None)
+        self._tags_created.discard(id(doc))
+        self.inline_commands.forget(doc)
+
 
     def extract_names_from_text(self, text):
         names = []
@@ -116,29 +253,67 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
             names = self._extract_names_from_text(text)
         finally:
             self.stop_llm_server()
-        print('names extracted:')
-        print(names)
+        log.debug("names extracted: %s", names)
         return names
 
-    def _extract_names_from_text(self, text):
-        """Call the LLM server to extract names from text"""
+    def trace_headers(self, trace_id):
+        """Headers that carry the correlation id through to llm_server.py"""
+        return {TRACE_HEADER: trace_id} if trace_id else {}
+
+    def name_memory_for(self, doc):
+        """Per-document name -> colour memory, seeded from the global one if enabled"""
+        doc_id = id(doc)
+        if doc_id not in self._name_memories:
+            memory = NameColourMemory(fallback=self.global_names)
+            path = self.name_memory_path(doc)
+            if path is not None:
+                memory.load(path, with_context=True)
+            self._name_memories[doc_id] = memory
+        return self._name_memories[doc_id]
+
+    def name_memory_path(self, doc):
+        """Where a saved document's name memory lives; None for unsaved documents"""
+        location = doc.get_file().get_location()
+        if location is None or self.document_names_dir is None:
+            return None
+        import hashlib
+        return self.document_names_dir / (hashlib.sha1(location.get_uri().encode('utf-8')).hexdigest() + '.json')
+
+    def save_name_memory(self, doc):
+        memory = self._name_memories.get(id(doc))
+        path = self.name_memory_path(doc) if memory is not None and memory.entries else None
+        if path is None:
+            return
+        try:
+            memory.save(path, with_context=True)
+        except OSError as e:
+            log.warning("Failed to save name colours to %s: %s", path, e)
+
+    def _extract_names_from_text(self, text, trace_id=None, known_names=None):
+        """Call the LLM server to extract names from text, skipping known_names"""
+        import requests
         if not hasattr(self, 'llm_server_url'):
-            print("LLM server URL not set. Did you call load_llm_model?")
+            log.warning("LLM server URL not set. Did you call load_llm_model?")
             return []
+        payload = {"text": text}
+        if known_names:
+            payload["known_names"] = known_names
         try:
-            resp = requests.post(
-                f"{self.llm_server_url}/extract_names",
-                json={"text": text}
-            )
+            with self.tracer.span('http /extract_names', trace_id, known=len(known_names or [])):
+                resp = requests.post(
+                    f"{self.llm_server_url}/extract_names",
+                    json=payload,
+                    headers=self.trace_headers(trace_id),
+                )
             if resp.status_code == 200:
-                print(resp.json())
                 data = resp.json()
+                log.debug("extract_names response: %s", data)
                 return data.get('names', [])
             else:
-                print(f"LLM server error: {resp.text}")
+                log.warning("LLM server error: %s", resp.text)
                 return []
         except Exception as e:
-            print(f"Failed to contact LLM server: {e}")
+            log.warning("Failed to contact LLM server: %s", e)
             return []
         
 
@@ -156,29 +331,36 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
         # Create a tag for task items (lines starting with --)
         if not tag_table.lookup('task-item'):
             tag = doc.create_tag('task-item', foreground='#3584e4')  # Nice blue
-            print("Created task-item tag")
+            log.debug("Created task-item tag")
         
         # Create a tag for completed items (containing "tick" or "Tick")
         if not tag_table.lookup('completed-item'):
             tag = doc.create_tag('completed-item', foreground='#26a269')  # Green
-            print("Created completed-item tag")
+            log.debug("Created completed-item tag")
 
         # Create a tag for completed items (containing "tick, but" or "Tick, but")
         if not tag_table.lookup('completed-item-but'):
             tag = doc.create_tag('completed-item-but', foreground="#98c03a")  # Green
-            print("Created completed-item-but tag")
+            log.debug("Created completed-item-but tag")
 
         # Create a tag for completed items (containing "tick, but" or "Tick, but")
         if not tag_table.lookup('maybe-completed-item'):
             tag = doc.create_tag('maybe-completed-item', foreground="#c09c3a")  # Green
-            print("Created maybe-completed-item tag")
+            log.debug("Created maybe-completed-item tag")
 
         self._tags_created.add(doc_id)
 
 
     def add_dynamic_tags(self, doc):
-        """Apply pastel color tags to names in self.llm_names"""
-        if not self.llm_names or not isinstance(self.llm_names, list):
+        """Apply pastel color tags to the names this document's memory has colours for"""
+        memory = self._name_memories.get(id(doc))
+        if memory is None:
+            return
+        start = doc.get_start_iter()
+        end = doc.get_end_iter()
+        text = doc.get_text(start, end, False)
+        pairs = memory.pairs(text)
+        if not pairs:
             return
         tag_table = doc.get_tag_table()
         # Define a pastel color mapping for common color names
@@ -196,22 +378,13 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
             'teal': '#b3fff6',
             'default': '#e0e0e0',
         }
-        for pair in self.llm_names:
-            if not isinstance(pair, (list, tuple)) or len(pair) != 2:
-                continue
-            name, color = pair
+        for name, color in pairs:
             tag_name = f"llm-name-{color}"
             pastel = pastel_colors.get(str(color).lower(), pastel_colors['default'])
             if not tag_table.lookup(tag_name):
                 doc.create_tag(tag_name, foreground=pastel)
         # Apply tags to all occurrences of each name
-        start = doc.get_start_iter()
-        end = doc.get_end_iter()
-        text = doc.get_text(start, end, False)
-        for pair in self.llm_names:
-            if not isinstance(pair, (list, tuple)) or len(pair) != 2:
-                continue
-            name, color = pair
+        for name, color in pairs:
             tag_name = f"llm-name-{color}"
             for match in re.finditer(re.escape(name), text, re.IGNORECASE):
                 s, e = match.start(), match.end()
@@ -221,6 +394,8 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
 
     def on_document_changed(self, doc):
         """Called whenever the document text changes"""
+        trace_id = new_trace_id() if self.tracer.enabled else None
+        changed_at = self.tracer.now()
         start = doc.get_start_iter()
         end = doc.get_end_iter()
         text = doc.get_text(start, end, False)
@@ -230,32 +405,48 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
         doc.remove_tag_by_name('completed-item', start, end)
         
         # Parse and apply tags
-        self.apply_highlighting(doc, text)
+        with self.tracer.span('apply_highlighting', trace_id):
+            has_tasks = self.apply_highlighting(doc, text, trace_id)
+
+        if has_tasks:
+            self.ensure_llm()
+            self.inline_commands.scan(doc, text, trace_id)
+        if not hasattr(self, 'llm_server_url'):
+            # LLM not needed yet, or still loading
+            return
 
 
         # throttle name extraction to once every 10 seconds
         now = time.time()
+        if self._pending_change_since is None:
+            self._pending_change_since = changed_at
         if now - self.time_check < 2:
             self.time_check = now
             # not enough time elapsed since last extraction; skip
-            #print(f"Skipping name extraction; last run {now - self.time_check:.1f}s ago")
             return
         # update last-run timestamp and allow extraction to proceed
         self.time_check = now
-        self.llm_names = self._extract_names_from_text(text)
-        print('names extracted:')
-        print(self.llm_names)
-
-        self.add_dynamic_tags(doc)
-
-    def apply_highlighting(self, doc, text):
-        """Find task patterns and apply colored tags"""
+        self.tracer.add_span('debounce', self._pending_change_since, self.tracer.now(), trace_id)
+        self._pending_change_since = None
+        # Only ask about names that are new or whose lines changed; reuse stored colours for the rest
+        memory = self.name_memory_for(doc)
+        names = self._extract_names_from_text(text, trace_id, memory.known_names(text))
+        memory.update(names, text)
+        log.debug("names extracted: %s", names)
+
+        with self.tracer.span('add_dynamic_tags', trace_id):
+            self.add_dynamic_tags(doc)
+
+    def apply_highlighting(self, doc, text, trace_id=None):
+        """Find task patterns and apply colored tags. Returns True if any task line was found."""
         lines = text.split('\n')
         char_offset = 0
+        has_tasks = False
         
         for line in lines:
             # Check if line starts with --
             if line.strip().startswith('--'):
+                has_tasks = True
                 # Get iterators for this line
                 start_iter = doc.get_iter_at_offset(char_offset)
                 end_iter = doc.get_iter_at_offset(char_offset + len(line))
@@ -271,16 +462,12 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
                 else:
                     doc.apply_tag_by_name('task-item', start_iter, end_iter)
 
-
-                ## LLM stuff
-
-                if 'I see you' in line.lower():
-                    self.run_inference_async("I see you")
             
             # Move to next line (including newline character)
             char_offset += len(line) + 1
         # After all other highlighting, apply dynamic tags for names
         self.add_dynamic_tags(doc)
+        return has_tasks
 
 
 
@@ -290,8 +477,9 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
         
     def load_the_model(self):
         # ❌ NO GTK CALLS HERE
+        import requests
         self.start_llm_server()
-        print("Waiting for LLM server to be ready...")
+        log.info("Waiting for LLM server to be ready...")
         
         # Wait for server to be ready
         
@@ -299,7 +487,7 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
             try:
                 resp = requests.get('http://localhost:19953/health', timeout=1)
                 if resp.status_code == 200:
-                    print("LLM server is ready to load a model - response:", resp.json())
+                    log.info("LLM server is ready to load a model - response: %s", resp.json())
                     break
             except:
                 pass
@@ -314,108 +502,121 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
 
     def on_work_finished(self, result):
         # ✅ Safe to touch GTK here
-        print("Model Loading finished: ", result)
+        log.info("Model Loading finished: %s", result)
         return False  # important: remove idle handler
 
     def load_llm_async(self):
         thread = threading.Thread(target=self.load_the_model, daemon=True)
         thread.start()
 
-    def do_inference_work(self, prompt, max_tokens=150, temperature=0.3, stop=None):
+    def infer(self, prompt, trace_id=None, max_tokens=150, temperature=0.3, stop=None):
+        """Blocking inference call for worker threads. Returns the response text or None."""
         # ❌ NO GTK CALLS HERE
+        import requests
         if stop is None:
             stop = ["</s>", "\n\n"]
-        print("Waiting for LLM server to be ready for inference...")
-        import time
-        for i in range(10):
-            try:
-                resp = requests.get('http://localhost:19953/health', timeout=1)
-                if resp.status_code == 200 and resp.json().get('model_loaded'):
-                    print("LLM server is ready for inference - response:", resp.json())
-                    break
-            except Exception as e:
-                print(f"Health check failed (attempt {i+1}/10): {e}")
-            time.sleep(1)
-        else:
-            print("LLM server not ready for inference after multiple attempts.")
-            GLib.idle_add(self.on_inference_finished, None)
-            return
+        # Set by load_llm_model once the model is in, so there's nothing to poll
+        wait_started = self.tracer.now()
+        if not self._model_ready.wait(MODEL_READY_TIMEOUT):
+            log.warning("LLM model not loaded after %ds, skipping inference.", MODEL_READY_TIMEOUT)
+            return None
+        self.tracer.add_span('wait_for_server', wait_started, self.tracer.now(), trace_id)
 
         # Now do inference
         try:
-            headers = {'Content-Type': 'application/json'}
+            headers = {'Content-Type': 'application/json', **self.trace_headers(trace_id)}
             payload = {
                 "prompt": prompt,
                 "max_tokens": max_tokens,
                 "temperature": temperature,
                 "stop": stop
             }
-            resp = requests.post(
-                f"http://localhost:19953/inference",
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
+            with self.tracer.span('http /inference', trace_id):
+                resp = requests.post(
+                    f"http://localhost:19953/inference",
+                    json=payload,
+                    headers=headers,
+                    timeout=30
+                )
             if resp.status_code == 200:
                 result = resp.json().get('response', '')
-                print(f"Inference result: {result}")
+                log.debug("Inference result: %s", result)
             else:
-                print(f"LLM server inference error: {resp.text}")
+                log.warning("LLM server inference error: %s", resp.text)
                 result = None
         except Exception as e:
-            print(f"Failed to contact LLM server for inference: {e}")
+            log.warning("Failed to contact LLM server for inference: %s", e)
             result = None
+        return result
+
+    def do_inference_work(self, prompt, max_tokens=150, temperature=0.3, stop=None, trace_id=None):
+        # ❌ NO GTK CALLS HERE
+        result = self.infer(prompt, trace_id, max_tokens, temperature, stop)
 
         # Schedule UI update safely
         GLib.idle_add(self.on_inference_finished, result)
 
     def on_inference_finished(self, result):
         # ✅ Safe to touch GTK here
-        print("Inference finished:", result)
+        log.info("Inference finished: %s", result)
         # You can update the UI or handle the result here
         return False  # important: remove idle handler
 
-    def run_inference_async(self, prompt, max_tokens=150, temperature=0.3, stop=None):
-        thread = threading.Thread(target=self.do_inference_work, args=(prompt, max_tokens, temperature, stop), daemon=True)
-        thread.start()
+    def run_inference_async(self, prompt, max_tokens=150, temperature=0.3, stop=None, trace_id=None):
+        """Queue inference on the shared bounded executor rather than a thread per call"""
+        if not self.inline_commands.submit(self.do_inference_work, prompt, max_tokens, temperature, stop, trace_id):
+            log.warning("Inference queue full, dropping prompt.")
 
-    def do_extract_names_work(self, text, prompts_path=None):
+    def do_extract_names_work(self, text, prompts_path=None, trace_id=None, known_names=None, doc=None):
         """Background thread: call LLM server to extract names."""
+        import requests
         if not hasattr(self, 'llm_server_url'):
-            print("LLM server URL not set. Did you call load_llm_model?")
+            log.warning("LLM server URL not set. Did you call load_llm_model?")
             result = []
         else:
             try:
                 payload = {"text": text}
                 if prompts_path:
                     payload["prompts_path"] = prompts_path
-                resp = requests.post(
-                    f"{self.llm_server_url}/extract_names",
-                    json=payload,
-                    timeout=30
-                )
+                if known_names:
+                    payload["known_names"] = known_names
+                with self.tracer.span('http /extract_names', trace_id):
+                    resp = requests.post(
+                        f"{self.llm_server_url}/extract_names",
+                        json=payload,
+                        headers=self.trace_headers(trace_id),
+                        timeout=30
+                    )
                 if resp.status_code == 200:
                     data = resp.json()
                     result = data.get('names', [])
                 else:
-                    print(f"LLM server error: {resp.text}")
+                    log.warning("LLM server error: %s", resp.text)
                     result = []
             except Exception as e:
-                print(f"Failed to contact LLM server: {e}")
+                log.warning("Failed to contact LLM server: %s", e)
                 result = []
-        GLib.idle_add(self.on_extract_names_finished, result)
+        GLib.idle_add(self.on_extract_names_finished, result, doc)
 
-    def on_extract_names_finished(self, names):
+    def on_extract_names_finished(self, names, doc=None):
         """Safe to touch GTK here. Update UI or state with extracted names."""
-        print("Extracted names (async):", names)
-        self.llm_names = names
-        # Optionally, update tags in the current document here
-        # Example: self.add_dynamic_tags(current_doc)
+        log.debug("Extracted names (async): %s", names)
+        # No memory means no document, or its tab was closed while we waited
+        memory = self._name_memories.get(id(doc)) if doc is not None else None
+        if memory is None:
+            return False
+        # Merge into the document's memory against its current text, then recolour
+        text = doc.get_text(doc.get_start_iter(), doc.get_end_iter(), False)
+        memory.update(names, text)
+        self.add_dynamic_tags(doc)
         return False  # Remove idle handler
 
-    def extract_names_async(self, text, prompts_path=None):
+    def extract_names_async(self, text, prompts_path=None, doc=None):
         """Start async extraction of names from text."""
-        thread = threading.Thread(target=self.do_extract_names_work, args=(text, prompts_path), daemon=True)
+        trace_id = new_trace_id() if self.tracer.enabled else None
+        known_names = self.name_memory_for(doc).known_names(text) if doc is not None else None
+        thread = threading.Thread(target=self.do_extract_names_work,
+                                  args=(text, prompts_path, trace_id, known_names, doc), daemon=True)
         thread.start()
 
 
@@ -427,39 +628,48 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
 
     def start_llm_server(self):
         """Start the LLM server using the env_and_load.sh script"""
-        print('\n CWD: \n')
-        print(os.getcwd())
+        import subprocess
         script_path = os.path.join(os.path.dirname(__file__), 'env_and_load.sh')
         log_path = os.path.join(os.path.dirname(__file__), 'logs', 'env_and_load.log')
-        print(f"Running script at: {script_path}")
+        log.debug("CWD: %s, running script at: %s", os.getcwd(), script_path)
         try:
-            print("Starting LLM server via env_and_load.sh...")
             with open(log_path, 'a') as log_file:
                 subprocess.Popen(['bash', script_path], stdout=log_file, stderr=log_file)
-            print(f"LLM server started via env_and_load.sh, output redirected to {log_path}")
+            log.info("LLM server started via env_and_load.sh, output redirected to %s", log_path)
         except Exception as e:
-            print(f"Failed to start LLM server: {e}")
+            log.warning("Failed to start LLM server: %s", e)
 
     def stop_llm_server(self):
-        """Stop the LLM server using the PID file"""
+        """Stop the LLM server using the PID file: SIGTERM so it can flush, SIGKILL if it lingers"""
+        import signal
         pid_file = self.this_dir + '/logs/llm_server.pid'
         
         if os.path.exists(pid_file):
             with open(pid_file, 'r') as f:
                 pid = f.read().strip()
             try:
-                os.kill(int(pid), 9)
-                print(f"LLM server (PID {pid}) killed.")
+                pid = int(pid)
+                os.kill(pid, signal.SIGTERM)
+                deadline = time.monotonic() + SERVER_STOP_TIMEOUT
+                while process_alive(pid) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                if process_alive(pid):
+                    os.kill(pid, signal.SIGKILL)
+                    log.info("LLM server (PID %s) did not exit after SIGTERM; killed.", pid)
+                else:
+                    log.info("LLM server (PID %s) stopped.", pid)
+            except ProcessLookupError:
+                log.info("LLM server (PID %s) already stopped.", pid)
             except Exception as e:
-                print(f"Failed to kill LLM server: {e}")
+                log.warning("Failed to stop LLM server: %s", e)
             os.remove(pid_file)
         else:
-            print("No llm_server.pid file found.")
+            log.info("No llm_server.pid file found.")
             
 
     def load_llm_model(self):
         """Request the LLM server to load the model"""
-        import time
+        import requests
         import json as _json
 
         server_url = 'http://localhost:19953'
@@ -476,17 +686,20 @@ class TextFlowPlugin(GObject.Object, Gedit.WindowActivatable):
                     timeout=10
                 )
 
-                print(resp.json())
                 if resp.status_code == 200:
-                    print(f"\n LLM model loaded from {model_path} - response: {resp.json()} \n")
+                    log.info("LLM model loaded from %s - response: %s", model_path, resp.json())
+                    self._model_ready.set()
                     break
                 else:
-                    print(f"LLM server load_model error: {resp.text}")
+                    log.warning("LLM server load_model error: %s", resp.text)
             except Exception as e:
-                print(f"Failed to contact LLM server (attempt {i+1}/10): {e}")
+                log.debug("Failed to contact LLM server (attempt %d/10): %s", i + 1, e)
             time.sleep(1)
         else:
-            print("Failed to load model after multiple attempts.")
+            log.warning("Failed to load model after multiple attempts.")
 
         self.llm_server_url = server_url
-        self.llm_model_path = model_path
\ No newline at end of file
+        self.llm_model_path = model_path
+
+
+MODULE_IMPORT_SECONDS = time.perf_counter() - _import_started